@@ -1,26 +1,62 @@
+import argparse
+import asyncio
+import atexit
+import importlib
+import importlib.util
+import json
 import os
+import random
+import re
 import sys
+import threading
+import time
+import weakref
+from typing import Iterator
 from dotenv import load_dotenv
 
+
+# Importações pesadas (google.genai puxa google.auth, httpx, pydantic...; opentelemetry)
+# são feitas sob demanda, memoizadas aqui. Na importação só verificamos se existem.
+_LAZY_MODULES = {}
+
+
+def _lazy_import(name):
+    module = _LAZY_MODULES.get(name)
+    if module is None:
+        module = _LAZY_MODULES[name] = importlib.import_module(name)
+    return module
+
+
+def _module_exists(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except Exception:
+        return False
+
+
 # Prefer the new Google GenAI SDK (google-genai). Fall back to the legacy
 # google-generativeai package when needed.
-try:
+if _module_exists("google.genai"):
     # New SDK: pip install google-genai
-    from google import genai
-    from google.genai import types as genai_types
-    from google.genai import errors as genai_errors
     NEW_GENAI = True
-except Exception:
-    try:
-        # Legacy (deprecated): pip install google-generativeai
-        import google.generativeai as genai
-        genai_types = None
-        genai_errors = None
-        NEW_GENAI = False
-    except ImportError as e:
-        raise ImportError(
-            "Instale 'google-genai' (recomendado) ou 'google-generativeai' (legado). Ex.: pip install google-genai"
-        ) from e
+elif _module_exists("google.generativeai"):
+    # Legacy (deprecated): pip install google-generativeai
+    NEW_GENAI = False
+else:
+    raise ImportError(
+        "Instale 'google-genai' (recomendado) ou 'google-generativeai' (legado). Ex.: pip install google-genai"
+    )
+
+
+def _lazy_genai():
+    """Módulo do SDK do Gemini em uso (novo ou legado), importado no primeiro uso."""
+    return _lazy_import("google.genai" if NEW_GENAI else "google.generativeai")
+
+
+def _lazy_genai_types():
+    """`google.genai.types` (apenas SDK novo; None no legado)."""
+    return _lazy_import("google.genai.types") if NEW_GENAI else None
+
 
 load_dotenv()  # opcional: carrega .env em desenvolvimento
 
@@ -35,14 +71,24 @@ if not logger.handlers:
     logger.addHandler(handler)
 logger.setLevel(os.getenv("GETDADOS_LOG_LEVEL", "INFO"))
 
-# OpenTelemetry tracer (opcional). Se não disponível, fornecemos um span no-op
-try:
-    from opentelemetry import trace as _trace
-    tracer = _trace.get_tracer(__name__)
-    OTEL_AVAILABLE = True
-except Exception:
-    OTEL_AVAILABLE = False
-    tracer = None
+# OpenTelemetry tracer (opcional), inicializado no primeiro span. Se não disponível,
+# fornecemos um span no-op
+OTEL_AVAILABLE = _module_exists("opentelemetry.trace")
+
+
+def _lazy_otel():
+    """Módulo `opentelemetry.trace`, ou None se o OpenTelemetry não puder ser importado."""
+    global OTEL_AVAILABLE
+    if OTEL_AVAILABLE:
+        try:
+            return _lazy_import("opentelemetry.trace")
+        except Exception:
+            OTEL_AVAILABLE = False
+    return None
+
+
+def _current_span():
+    return _lazy_otel().get_current_span()
 
 @contextmanager
 def _noop_span(name, attributes=None):
@@ -59,37 +105,38 @@ def start_span(name, attributes=None):
     # Return a context manager-compatible object. Do NOT call __enter__ here; let the
     # caller use `with` to manage context to avoid interfering with opentelemetry's
     # internal context manager implementation (e.g., _AgnosticContextManager).
-    if OTEL_AVAILABLE and tracer:
-        return tracer.start_as_current_span(name)
+    trace = _lazy_otel()
+    if trace is not None:
+        tracer = _LAZY_MODULES.get("tracer")
+        if tracer is None:
+            tracer = _LAZY_MODULES["tracer"] = trace.get_tracer(__name__)
+        return tracer.start_as_current_span(name, attributes=attributes)
     return _noop_span(name, attributes)
 
 
+# no-op decorator quando traceloop não está disponível/configurado
+def _noop_workflow(name=None):
+    def _decorator(fn):
+        return fn
+    return _decorator
+
+
 # Traceloop (opcional): integra com Dynatrace via OpenTelemetry.
-# Inicializamos o SDK apenas se as variáveis necessárias estiverem definidas.
-try:
-    # Tentar importar o módulo primeiro
-    from traceloop.sdk import Traceloop
-except Exception:
-    TRACELOOP_AVAILABLE = False
-    # no-op decorator quando traceloop não está disponível
-    def workflow(name=None):
-        def _decorator(fn):
-            return fn
-        return _decorator
-else:
-    # Só inicializar se houver credenciais/endpoint configurado para evitar warnings do SDK
-    tl_api_key = os.getenv("TRACELOOP_API_KEY")
-    tl_base = os.getenv("TRACELOOP_BASE_URL")
-    tl_headers = os.getenv("TRACELOOP_HEADERS")
-    _tl_app = os.getenv("TRACELOOP_APP_NAME", "getDados_app")
-
-    if not (tl_api_key or (tl_base and tl_headers)):
-        TRACELOOP_AVAILABLE = False
-        def workflow(name=None):
-            def _decorator(fn):
-                return fn
-            return _decorator
-    else:
+# Só importamos/inicializamos o SDK se houver credenciais/endpoint configurado: evita
+# o custo da importação e warnings do SDK quando não é usado.
+tl_api_key = os.getenv("TRACELOOP_API_KEY")
+tl_base = os.getenv("TRACELOOP_BASE_URL")
+tl_headers = os.getenv("TRACELOOP_HEADERS")
+_tl_app = os.getenv("TRACELOOP_APP_NAME", "getDados_app")
+
+TRACELOOP_AVAILABLE = False
+workflow = _noop_workflow
+if tl_api_key or (tl_base and tl_headers):
+    try:
+        from traceloop.sdk import Traceloop
+    except Exception:
+        Traceloop = None
+    if Traceloop is not None:
         try:
             # Configure via env vars (Traceloop SDK will read TRACELOOP_BASE_URL/HEADERS or API key)
             Traceloop.init(app_name="tl_app", 
@@ -99,21 +146,475 @@ else:
             from traceloop.sdk.decorators import workflow
             TRACELOOP_AVAILABLE = True
         except Exception as e:
-            TRACELOOP_AVAILABLE = False
-            def workflow(name=None):
-                def _decorator(fn):
-                    return fn
-                return _decorator
             print(f"Warning: Traceloop não foi inicializado: {e}")
 
-@workflow(name="perguntar")
-def perguntar(pergunta: str) -> str:
-    """Faz uma pergunta ao modelo Gemini.
 
-    É necessário definir uma das variáveis de ambiente:
-    - GOOGLE_API_KEY (chave de API)
-    - GOOGLE_APPLICATION_CREDENTIALS (caminho para JSON da conta de serviço)
+# Clientes do SDK novo reutilizados entre chamadas (mantém o pool HTTP/TLS aberto),
+# indexados pela api_key usada para criá-los.
+_CLIENT_CACHE = {}
+
+
+def _get_client(api_key=None):
+    """Retorna um genai.Client compartilhado para a api_key informada (criado sob demanda)."""
+    client = _CLIENT_CACHE.get(api_key)
+    if client is None:
+        genai = _lazy_genai()
+        client = genai.Client(api_key=api_key) if api_key else genai.Client()
+        client = _CLIENT_CACHE.setdefault(api_key, client)
+    return client
+
+
+# Clientes usados via `client.aio`, um por event loop: a sessão HTTP assíncrona (e seu
+# pool keep-alive) pertence ao loop que a criou e não pode ser reaproveitada por outro
+# asyncio.run(). Clientes de loops já fechados são descartados na chamada seguinte.
+_AIO_CLIENTS = {}
+_AIO_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_aio_client(api_key=None):
+    """Retorna um genai.Client para uso assíncrono (`.aio`) no event loop corrente."""
+    loop = asyncio.get_running_loop()
+    with _AIO_CLIENTS_LOCK:
+        for stale in [other for other in _AIO_CLIENTS if other.is_closed()]:
+            for client in _AIO_CLIENTS.pop(stale).values():
+                _close_client(client)
+        clients = _AIO_CLIENTS.setdefault(loop, {})
+        client = clients.get(api_key)
+        if client is None:
+            genai = _lazy_genai()
+            client = clients[api_key] = genai.Client(api_key=api_key) if api_key else genai.Client()
+    return client
+
+
+def _close_client(client, loop=None):
+    # Fecha o lado síncrono e, se o loop dono ainda puder rodar, a sessão assíncrona
+    try:
+        client.close()
+    except Exception:
+        pass
+    aclose = getattr(getattr(client, "aio", None), "aclose", None)
+    if aclose is not None and loop is not None and not loop.is_closed() and not loop.is_running():
+        try:
+            loop.run_until_complete(aclose())
+        except Exception:
+            pass
+
+
+@atexit.register
+def _close_clients():
+    # Fecha todos os clientes em cache no encerramento do interpretador
+    while _CLIENT_CACHE:
+        _, client = _CLIENT_CACHE.popitem()
+        _close_client(client)
+    while _AIO_CLIENTS:
+        loop, clients = _AIO_CLIENTS.popitem()
+        for client in clients.values():
+            _close_client(client, loop)
+
+# Cache de respostas por correspondência exata (opcional, GENAI_CACHE_ENABLED=1).
+# Usa cachetools.TTLCache quando instalado; caso contrário um dict simples com expiração.
+# Opcionalmente compartilhado entre processos via Redis (GENAI_CACHE_REDIS_URL).
+_CACHE_ENABLED = os.getenv("GENAI_CACHE_ENABLED", "0") == "1"
+try:
+    _CACHE_TTL = int(os.getenv("GENAI_CACHE_TTL", "3600"))
+except Exception:
+    _CACHE_TTL = 3600
+try:
+    _CACHE_MAXSIZE = int(os.getenv("GENAI_CACHE_MAXSIZE", "1024"))
+except Exception:
+    _CACHE_MAXSIZE = 1024
+
+try:
+    from cachetools import TTLCache as _TTLCache
+except Exception:
+    class _TTLCache(dict):
+        """Substituto mínimo do cachetools.TTLCache (expiração por item, descarte do mais antigo)."""
+        def __init__(self, maxsize, ttl):
+            super().__init__()
+            self.maxsize = maxsize
+            self.ttl = ttl
+
+        def __getitem__(self, key):
+            expires_at, value = super().__getitem__(key)
+            if expires_at < time.monotonic():
+                del self[key]
+                raise KeyError(key)
+            return value
+
+        def get(self, key, default=None):
+            try:
+                return self[key]
+            except KeyError:
+                return default
+
+        def __setitem__(self, key, value):
+            if key not in self and len(self) >= self.maxsize:
+                del self[next(iter(self))]
+            super().__setitem__(key, (time.monotonic() + self.ttl, value))
+
+_RESPONSE_CACHE = _TTLCache(maxsize=_CACHE_MAXSIZE, ttl=_CACHE_TTL)
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+_redis = None
+if _CACHE_ENABLED and os.getenv("GENAI_CACHE_REDIS_URL"):
+    try:
+        import redis
+        _redis = redis.Redis.from_url(os.getenv("GENAI_CACHE_REDIS_URL"))
+    except Exception as e:
+        logger.warning("Cache Redis indisponível, usando apenas cache em memória: %s", e)
+        _redis = None
+
+
+# Serialização canônica (chaves ordenadas) para as chaves de cache; orjson quando instalado.
+# O fallback gera os mesmos bytes que o orjson, então as chaves no Redis são compatíveis.
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+except Exception:
+    def _dumps(obj):
+        return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Hash das chaves de cache: BLAKE3 (SIMD) quando instalado, senão SHA-256. As chaves
+# mudam com o backend; processos que compartilham Redis/GENAI_SEMCACHE_PATH devem usar o mesmo.
+try:
+    from blake3 import blake3 as _hash
+except ImportError:
+    from hashlib import sha256 as _hash
+
+
+def _cache_key(model_name, pergunta, instructions, temperature, max_output_tokens):
+    payload = {"m": model_name, "p": pergunta, "i": instructions or "", "t": temperature, "mx": max_output_tokens}
+    return _hash(_dumps(payload)).hexdigest()
+
+
+def _cache_get(key):
+    if not _CACHE_ENABLED:
+        return None
+    with _RESPONSE_CACHE_LOCK:
+        value = _RESPONSE_CACHE.get(key)
+    if value is None and _redis is not None:
+        try:
+            raw = _redis.get(f"genai:{key}")
+            if raw is not None:
+                value = raw.decode("utf-8")
+                with _RESPONSE_CACHE_LOCK:
+                    _RESPONSE_CACHE[key] = value
+        except Exception as e:
+            logger.warning("Falha ao ler cache Redis: %s", e)
+    return value
+
+
+def _cache_put(key, value):
+    if not _CACHE_ENABLED:
+        return
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = value
+    if _redis is not None:
+        try:
+            _redis.set(f"genai:{key}", value, ex=_CACHE_TTL)
+        except Exception as e:
+            logger.warning("Falha ao gravar cache Redis: %s", e)
+
+
+# Variantes para código assíncrono: com Redis, a E/S de rede roda em uma thread para
+# não bloquear o event loop; só com o cache em memória, a chamada direta é mais barata.
+async def _cache_get_async(key):
+    if _redis is not None and _CACHE_ENABLED:
+        return await asyncio.to_thread(_cache_get, key)
+    return _cache_get(key)
+
+
+async def _cache_put_async(key, value):
+    if _redis is not None and _CACHE_ENABLED:
+        await asyncio.to_thread(_cache_put, key, value)
+    else:
+        _cache_put(key, value)
+
+
+# Cache semântico (opcional, GENAI_SEMCACHE_ENABLED=1, apenas SDK novo): reaproveita
+# respostas de perguntas parecidas comparando embeddings por similaridade de cosseno.
+# Usa faiss quando instalado; sem faiss, busca exaustiva com numpy.
+# Entradas expiram após GENAI_CACHE_TTL, como no cache exato; acima de GENAI_SEMCACHE_MAXSIZE,
+# as mais antigas saem. Limiar, modelo de embedding e limite são lidos em `_reload_config`.
+_SEMCACHE_ENABLED = os.getenv("GENAI_SEMCACHE_ENABLED", "0") == "1"
+_SEMCACHE_PATH = os.getenv("GENAI_SEMCACHE_PATH")  # opcional: persiste índice + respostas em disco
+
+if _SEMCACHE_ENABLED:
+    try:
+        import numpy as np
+    except Exception:
+        logger.warning("GENAI_SEMCACHE_ENABLED=1 requer numpy; cache semântico desativado.")
+        _SEMCACHE_ENABLED = False
+    try:
+        import faiss
+    except Exception:
+        faiss = None
+
+_SEMCACHE_LOCK = threading.Lock()
+# Vizinhos examinados por busca no faiss: o mais próximo pode ser de outro namespace
+_SEMCACHE_TOP_K = 16
+_SEMCACHE = {"index": None, "vectors": None, "entries": [], "loaded": False}
+
+
+def _semcache_load():
+    # Carrega índice/respostas persistidos na primeira utilização
+    _SEMCACHE["loaded"] = True
+    if not _SEMCACHE_PATH or not os.path.exists(_SEMCACHE_PATH + ".json"):
+        return
+    try:
+        with open(_SEMCACHE_PATH + ".json", encoding="utf-8") as f:
+            entries = json.load(f)
+        if faiss is not None:
+            index = faiss.read_index(_SEMCACHE_PATH)
+            n_vectors = index.ntotal
+            _SEMCACHE["index"] = index
+        else:
+            vectors = np.load(_SEMCACHE_PATH + ".npy")
+            n_vectors = vectors.shape[0]
+            _SEMCACHE["vectors"] = vectors
+        if n_vectors != len(entries):
+            raise ValueError(f"{n_vectors} vetores para {len(entries)} respostas")
+        _SEMCACHE["entries"] = entries
+        _semcache_prune(time.time(), _SEMCACHE_MAXSIZE)
+    except Exception as e:
+        logger.warning("Falha ao carregar cache semântico de %s: %s", _SEMCACHE_PATH, e)
+        _SEMCACHE.update(index=None, vectors=None, entries=[])
+
+
+def _semcache_prune(now, limit):
+    # Remove entradas expiradas e mantém só as `limit` mais recentes (entries está em ordem de inserção)
+    entries = _SEMCACHE["entries"]
+    keep = [i for i, e in enumerate(entries) if now - e.get("ts", 0) < _CACHE_TTL]
+    keep = keep[max(0, len(keep) - limit):]
+    if len(keep) == len(entries):
+        return
+    if not keep:
+        _SEMCACHE.update(index=None, vectors=None, entries=[])
+        return
+    if faiss is not None:
+        vectors = _SEMCACHE["index"].reconstruct_n(0, len(entries))[keep]
+        _SEMCACHE["index"] = faiss.IndexFlatIP(vectors.shape[1])
+        _SEMCACHE["index"].add(vectors)
+    else:
+        _SEMCACHE["vectors"] = _SEMCACHE["vectors"][keep]
+    _SEMCACHE["entries"] = [entries[i] for i in keep]
+
+
+@atexit.register
+def _semcache_save():
+    if not (_SEMCACHE_ENABLED and _SEMCACHE_PATH and _SEMCACHE["entries"]):
+        return
+    try:
+        with _SEMCACHE_LOCK:
+            if faiss is not None:
+                faiss.write_index(_SEMCACHE["index"], _SEMCACHE_PATH)
+            else:
+                with open(_SEMCACHE_PATH + ".npy", "wb") as f:
+                    np.save(f, _SEMCACHE["vectors"][:len(_SEMCACHE["entries"])])
+            with open(_SEMCACHE_PATH + ".json", "w", encoding="utf-8") as f:
+                json.dump(_SEMCACHE["entries"], f, ensure_ascii=False)
+    except Exception as e:
+        logger.warning("Falha ao salvar cache semântico em %s: %s", _SEMCACHE_PATH, e)
+
+
+def _semcache_embed(client, text):
+    """Retorna o embedding normalizado (float32) de `text`, ou None em caso de falha."""
+    try:
+        result = client.models.embed_content(model=_SEMCACHE_MODEL, contents=text)
+        vec = np.asarray(result.embeddings[0].values, dtype="float32")
+    except Exception as e:
+        logger.warning("Falha ao gerar embedding para cache semântico: %s", e)
+        return None
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else None
+
+
+def _semcache_check_dim(vec):
+    # Índice de outro modelo de embedding (outra dimensão) é descartado em vez de quebrar a busca
+    if faiss is not None:
+        dim = _SEMCACHE["index"].d if _SEMCACHE["index"] is not None else None
+    else:
+        dim = _SEMCACHE["vectors"].shape[1] if _SEMCACHE["vectors"] is not None else None
+    if dim is not None and dim != vec.shape[0]:
+        logger.warning("Cache semântico com dimensão %d, embedding atual tem %d; descartando índice.", dim, vec.shape[0])
+        _SEMCACHE.update(index=None, vectors=None, entries=[])
+
+
+def _semcache_lookup(vec, namespace):
+    """Procura a resposta mais próxima de `vec`; retorna o texto se acima do limiar.
+
+    Falhas do índice contam como ausência no cache.
     """
+    try:
+        with _SEMCACHE_LOCK:
+            return _semcache_lookup_locked(vec, namespace)
+    except Exception as e:
+        logger.warning("Falha ao consultar cache semântico: %s", e)
+        return None
+
+
+def _semcache_lookup_locked(vec, namespace):
+    if not _SEMCACHE["loaded"]:
+        _semcache_load()
+    _semcache_check_dim(vec)
+    entries = _SEMCACHE["entries"]
+    if not entries:
+        return None
+    # Só reaproveita respostas geradas com o mesmo modelo/instruções/limites: escolhe o
+    # vizinho mais próximo dentro do namespace, não apenas o mais próximo global.
+    if faiss is not None:
+        scores, ids = _SEMCACHE["index"].search(vec[None, :], min(_SEMCACHE_TOP_K, len(entries)))
+        candidates = zip(scores[0].tolist(), ids[0].tolist())
+    else:
+        sims = _SEMCACHE["vectors"][:len(entries)] @ vec
+        candidates = ((float(sims[i]), i) for i in np.argsort(-sims))
+    now = time.time()
+    for score, idx in candidates:
+        if idx < 0 or score < _SEMCACHE_THRESHOLD:
+            return None
+        if entries[idx]["ns"] == namespace and now - entries[idx].get("ts", 0) < _CACHE_TTL:
+            break
+    else:
+        return None
+    entry = entries[idx]
+    logger.info("Resposta obtida do cache semântico (similaridade=%.3f)", score)
+    return entry["response"]
+
+
+def _semcache_add(vec, namespace, pergunta, response_text):
+    try:
+        with _SEMCACHE_LOCK:
+            _semcache_add_locked(vec, namespace, pergunta, response_text)
+    except Exception as e:
+        logger.warning("Falha ao gravar no cache semântico: %s", e)
+
+
+def _semcache_add_locked(vec, namespace, pergunta, response_text):
+    _semcache_check_dim(vec)
+    now = time.time()
+    if len(_SEMCACHE["entries"]) >= _SEMCACHE_MAXSIZE:
+        # Poda com folga de 10% para não reconstruir o índice a cada inserção
+        _semcache_prune(now, max(1, _SEMCACHE_MAXSIZE * 9 // 10) - 1)
+    n = len(_SEMCACHE["entries"])
+    if faiss is not None:
+        if _SEMCACHE["index"] is None:
+            _SEMCACHE["index"] = faiss.IndexFlatIP(vec.shape[0])
+        _SEMCACHE["index"].add(vec[None, :])
+    else:
+        # Buffer com capacidade dobrada ao encher: inserções em O(1) amortizado
+        vectors = _SEMCACHE["vectors"]
+        if vectors is None or n >= vectors.shape[0]:
+            grown = np.empty((max(64, 2 * n), vec.shape[0]), dtype="float32")
+            if vectors is not None:
+                grown[:n] = vectors[:n]
+            _SEMCACHE["vectors"] = vectors = grown
+        vectors[n] = vec
+    _SEMCACHE["entries"].append({"ns": namespace, "prompt": pergunta, "response": response_text, "ts": now})
+
+
+def _generate_config(max_output_tokens):
+    # Use typed config when available
+    genai_types = _lazy_genai_types()
+    if genai_types:
+        return genai_types.GenerateContentConfig(
+            temperature=0.6,
+            max_output_tokens=max_output_tokens,
+        )
+    return {"temperature": 0.6, "max_output_tokens": max_output_tokens}
+
+
+# Os modelos padrão (pro/2.5/3) "pensam" antes de responder e os tokens de raciocínio
+# contam em max_output_tokens; abaixo de ~8k é comum esgotar o limite sem texto visível.
+_DEFAULT_MAX_OUTPUT_TOKENS = 8192
+_MAX_ESTIMATED_OUTPUT_TOKENS = 32768
+
+
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except Exception:
+        return cast(default)
+
+
+def _reload_config():
+    """Lê as variáveis GENAI_* para as constantes do módulo.
+
+    Executado na importação; chame novamente (p.ex. em testes) após alterar `os.environ`.
+    As credenciais (GOOGLE_*) continuam sendo lidas a cada chamada, em `_settings`.
+    Só valem na importação as variáveis que criam objetos ou importam dependências:
+    GENAI_CACHE_ENABLED/TTL/MAXSIZE/REDIS_URL e GENAI_SEMCACHE_ENABLED/PATH.
+    GENAI_MAX_CONCURRENCY vale para event loops que ainda não fizeram chamadas.
+    """
+    global _MODEL_NAME, _MAX_OUTPUT_TOKENS, _FALLBACK_MODELS, _MODELS_TO_TRY
+    global _INSTRUCTIONS, _INSTRUCTION_SNIPPET, _BASE_CONFIG
+    global _SEMCACHE_THRESHOLD, _SEMCACHE_MODEL, _SEMCACHE_MAXSIZE
+    global _CONTEXT_CACHE_ENABLED, _CONTEXT_CACHE_TTL
+    global _MAX_CONCURRENCY, _RPM, _BUCKET, _MAX_RETRIES, _HEDGE_ENABLED, _HEDGE_DELAY, _BATCH_MODE
+
+    # Ajuste o nome do modelo conforme sua conta (p.ex.: 'gemini-pro-latest' ou 'gemini-2.5-flash').
+    # Pode ser sobrescrito pela variável de ambiente GENAI_MODEL se preferir outro modelo.
+    _MODEL_NAME = os.getenv("GENAI_MODEL", "gemini-pro-latest")
+
+    # Allow overriding max output tokens via env var; when unset, the budget is sized per
+    # question (see _output_budget)
+    try:
+        _MAX_OUTPUT_TOKENS = int(os.environ["GENAI_MAX_OUTPUT_TOKENS"])
+    except Exception:
+        _MAX_OUTPUT_TOKENS = None
+
+    # Prepare fallback model list (can be overridden with GENAI_FALLBACK_MODELS env var, comma-separated)
+    env_fallback = os.getenv("GENAI_FALLBACK_MODELS")
+    if env_fallback:
+        _FALLBACK_MODELS = [m.strip() for m in env_fallback.split(",") if m.strip()]
+    else:
+        # Fallback ordered by likely accuracy/quality
+        _FALLBACK_MODELS = ["gemini-pro-latest", "gemini-3-pro-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-3-flash-preview"]
+    _MODELS_TO_TRY = [_MODEL_NAME] + [m for m in _FALLBACK_MODELS if m != _MODEL_NAME]
+
+    # Optionally include instructions from the environment (GENAI_INSTRUCTIONS).
+    _INSTRUCTIONS = os.getenv("GENAI_INSTRUCTIONS") or None
+    _INSTRUCTION_SNIPPET = _INSTRUCTIONS[:256] if _INSTRUCTIONS else None
+
+    # Construído no primeiro uso (ver _new_sdk_request) para não importar o SDK na carga do módulo
+    _BASE_CONFIG = None
+
+    # Cache semântico e context cache (ver as seções correspondentes)
+    _SEMCACHE_THRESHOLD = _env_number("GENAI_SEMCACHE_THRESHOLD", "0.92", float)
+    _SEMCACHE_MODEL = os.getenv("GENAI_SEMCACHE_EMBED_MODEL", "text-embedding-004")
+    _SEMCACHE_MAXSIZE = max(1, _env_number("GENAI_SEMCACHE_MAXSIZE", "10000"))
+    _CONTEXT_CACHE_ENABLED = os.getenv("GENAI_CONTEXT_CACHE_ENABLED", "0") == "1"
+    _CONTEXT_CACHE_TTL = _env_number("GENAI_CONTEXT_CACHE_TTL", "3600")
+
+    # Concorrência, vazão, novas tentativas e hedge das chamadas assíncronas
+    _MAX_CONCURRENCY = _env_number("GENAI_MAX_CONCURRENCY", "8")
+    _RPM = _env_number("GENAI_RPM", "0", float)
+    _BUCKET = {"tokens": max(1.0, _RPM / 60.0), "ts": time.monotonic()}
+    _MAX_RETRIES = _env_number("GENAI_MAX_RETRIES", "3")
+    _HEDGE_ENABLED = os.getenv("GENAI_HEDGE_ENABLED", "0") == "1"
+    _HEDGE_DELAY = _env_number("GENAI_HEDGE_MS", "800", float) / 1000
+
+    # Batch API em perguntar_bulk (GENAI_BATCH_MODE=0 usa chamadas concorrentes)
+    _BATCH_MODE = os.getenv("GENAI_BATCH_MODE", "1") != "0"
+
+
+_reload_config()
+
+
+def _output_budget(pergunta, max_output_tokens=None):
+    """Limite de tokens de saída: argumento explícito > GENAI_MAX_OUTPUT_TOKENS > estimativa pelo prompt."""
+    if max_output_tokens is not None:
+        return max_output_tokens
+    if _MAX_OUTPUT_TOKENS is not None:
+        return _MAX_OUTPUT_TOKENS
+    # Perguntas longas tendem a pedir respostas longas: cresce com o prompt, entre 8192 e 32768
+    return min(_MAX_ESTIMATED_OUTPUT_TOKENS, max(_DEFAULT_MAX_OUTPUT_TOKENS, len(pergunta) // 2))
+
+
+def _settings(pergunta="", max_output_tokens=None):
+    """Valida as credenciais e retorna (api_key, modelo, limite de tokens) para a pergunta."""
     api_key = os.getenv("GOOGLE_API_KEY")
     cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
@@ -121,314 +622,711 @@ def perguntar(pergunta: str) -> str:
         raise RuntimeError(
             "Defina GOOGLE_API_KEY ou GOOGLE_APPLICATION_CREDENTIALS antes de executar."
         )
+    return api_key, _MODEL_NAME, _output_budget(pergunta, max_output_tokens)
 
-    # Ajuste o nome do modelo conforme sua conta (p.ex.: 'gemini-pro-latest' ou 'gemini-2.5-flash').
-    # Pode ser sobrescrito pela variável de ambiente GENAI_MODEL se preferir outro modelo.
-    model_name = os.getenv("GENAI_MODEL", "gemini-pro-latest")
 
-    # Allow overriding max output tokens via env var; default to 65536 to avoid truncation
+def _new_sdk_request(pergunta, max_output_tokens):
+    """Monta (config, prompt, trecho das instruções) para client.models.generate_content."""
+    global _BASE_CONFIG
+    if max_output_tokens != (_MAX_OUTPUT_TOKENS or _DEFAULT_MAX_OUTPUT_TOKENS):
+        base_config = _generate_config(max_output_tokens)
+    else:
+        if _BASE_CONFIG is None:
+            _BASE_CONFIG = _generate_config(max_output_tokens)
+        base_config = _BASE_CONFIG
+
+    # If GENAI_INSTRUCTIONS is not set, send the user prompt as-is (avoids using role-based
+    # message structures that some SDK versions don't accept).
+    if _INSTRUCTIONS:
+        prompt_for_model = f"INSTRUCTIONS:\n{_INSTRUCTIONS}\n\nUSER_QUESTION:\n{pergunta}"
+    else:
+        prompt_for_model = pergunta
+
+    return base_config, prompt_for_model, _INSTRUCTION_SNIPPET
+
+
+# Context caching do Gemini (opcional, GENAI_CONTEXT_CACHE_ENABLED=1): envia GENAI_INSTRUCTIONS
+# uma única vez por modelo via client.caches.create e referencia o cache nas chamadas seguintes.
+# O Gemini exige um tamanho mínimo de conteúdo para criar o cache; se a criação falhar,
+# as instruções continuam indo inline no prompt até o próximo TTL (GENAI_CONTEXT_CACHE_TTL).
+_CONTEXT_CACHES = {}  # (api_key, hash(instruções + modelo)) -> (nome do cache ou None, expira_em)
+_CONTEXT_CACHES_LOCK = threading.Lock()
+
+
+def _context_cache_entry(api_key, model, instructions, now):
+    """Entrada (nome, expira_em) ainda válida em `_CONTEXT_CACHES`, ou None; não acessa a rede."""
+    key = (api_key, _hash((instructions + model).encode()).hexdigest())
+    with _CONTEXT_CACHES_LOCK:
+        entry = _CONTEXT_CACHES.get(key)
+    # Renova um pouco antes de expirar para não referenciar um cache já removido
+    if entry is not None and entry[1] - 60 > now:
+        return entry
+    return None
+
+
+def _context_cache_name(client, api_key, model, instructions):
+    """Retorna o nome do CachedContent com as instruções para `model`, criando/renovando se preciso."""
+    key = (api_key, _hash((instructions + model).encode()).hexdigest())
+    now = time.time()
+    entry = _context_cache_entry(api_key, model, instructions, now)
+    if entry is not None:
+        return entry[0]
+
+    name = None
     try:
-        max_output_tokens = int(os.getenv("GENAI_MAX_OUTPUT_TOKENS", "65536"))
-    except Exception:
-        max_output_tokens = 65536
+        cache = client.caches.create(
+            model=model,
+            config=_lazy_genai_types().CreateCachedContentConfig(
+                contents=[f"INSTRUCTIONS:\n{instructions}"],
+                ttl=f"{_CONTEXT_CACHE_TTL}s",
+            ),
+        )
+        name = cache.name
+        logger.info("Context cache criado para %s: %s", model, name)
+    except Exception as e:
+        logger.warning("Falha ao criar context cache para %s; enviando instruções inline: %s", model, e)
+    with _CONTEXT_CACHES_LOCK:
+        _CONTEXT_CACHES[key] = (name, now + _CONTEXT_CACHE_TTL)
+    return name
 
-    # Prefer the new google-genai SDK when available
-    if NEW_GENAI:
-        client = genai.Client(api_key=api_key) if api_key else genai.Client()
+
+def _request_for_model(client, api_key, m, pergunta, max_output_tokens, base_config, prompt_for_model):
+    """Retorna (contents, config) para o modelo `m`, usando o context cache das instruções quando ativo."""
+    genai_types = _lazy_genai_types()
+    if not (_CONTEXT_CACHE_ENABLED and _INSTRUCTIONS and genai_types):
+        return prompt_for_model, base_config
+    cache_name = _context_cache_name(client, api_key, m, _INSTRUCTIONS)
+    if cache_name is None:
+        return prompt_for_model, base_config
+    config = genai_types.GenerateContentConfig(
+        cached_content=cache_name,
+        temperature=0.6,
+        max_output_tokens=max_output_tokens,
+    )
+    return f"USER_QUESTION:\n{pergunta}", config
+
+
+def _semcache_check(client, pergunta, model_name, max_output_tokens):
+    """Consulta o cache semântico; retorna (resposta_em_cache, embedding, namespace)."""
+    if not _SEMCACHE_ENABLED:
+        return None, None, None
+    # O modelo de embedding entra no namespace: vetores de modelos distintos não são comparáveis
+    sem_namespace = _cache_key(model_name, _SEMCACHE_MODEL, _INSTRUCTIONS, 0.6, max_output_tokens)
+    sem_vec = _semcache_embed(client, pergunta)
+    if sem_vec is None:
+        return None, None, None
+    return _semcache_lookup(sem_vec, sem_namespace), sem_vec, sem_namespace
+
+
+def _extract_text(resp):
+    """Extrai o texto das diferentes formas de resposta dos SDKs; None se não houver texto."""
+    text = getattr(resp, "output_text", None) or getattr(resp, "text", None)
+    if text:
+        return text
+
+    # SDK novo: candidates[0].content.parts
+    candidates = getattr(resp, "candidates", None)
+    if candidates:
         try:
-            # Use typed config when available
-            if genai_types:
-                base_config = genai_types.GenerateContentConfig(
-                    temperature=0.6,
-                    max_output_tokens=max_output_tokens,
-                )
-            else:
-                base_config = {"temperature": 0.6, "max_output_tokens": max_output_tokens} 
+            return "".join(p.text for p in candidates[0].content.parts if getattr(p, "text", None)) or None
+        except Exception:
+            return None
 
-            # Prepare fallback model list (can be overridden with GENAI_FALLBACK_MODELS env var, comma-separated)
-            env_fallback = os.getenv("GENAI_FALLBACK_MODELS")
-            if env_fallback:
-                fallback_models = [m.strip() for m in env_fallback.split(",") if m.strip()]
+    # Fallback: try to collect text fragments from resp.output (Responses API legada)
+    texts = []
+    for item in getattr(resp, "output", None) or []:
+        content = item.get("content", []) if isinstance(item, dict) else getattr(item, "content", [])
+        for c in content or []:
+            if isinstance(c, dict):
+                ctype, ctext = c.get("type"), c.get("text")
             else:
-                # Fallback ordered by likely accuracy/quality
-                fallback_models = ["gemini-pro-latest", "gemini-3-pro-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-3-flash-preview"]
+                ctype, ctext = getattr(c, "type", None), getattr(c, "text", None)
+            if ctype == "output_text" or ctext:
+                texts.append(ctext or "")
+    return "\n".join(texts) or None
+
+
+def _finish_reason(resp):
+    """finish_reason do primeiro candidato (p.ex. "STOP", "MAX_TOKENS"), ou None."""
+    try:
+        reason = resp.candidates[0].finish_reason
+    except Exception:
+        return None
+    return getattr(reason, "name", reason)
 
-            models_to_try = [model_name] + [m for m in fallback_models if m != model_name]
 
-            last_not_found_exc = None
-            for m in models_to_try:
+def _empty_response_error(m, finish_reason):
+    return RuntimeError(
+        f"Modelo {m} não retornou texto (finish_reason={finish_reason}). "
+        "Se for MAX_TOKENS, aumente max_output_tokens/GENAI_MAX_OUTPUT_TOKENS."
+    )
+
+
+def _finish_response(m, resp, prompt_len, max_output_tokens, instruction_snippet=None):
+    """Extrai o texto da resposta do SDK novo e registra a resposta (ver `_record_response`)."""
+    # Attach the instruction snippet to the span for observability
+    try:
+        if instruction_snippet and OTEL_AVAILABLE:
+            _current_span().set_attribute("instruction_snippet", instruction_snippet)
+    except Exception:
+        pass
+    # Extract text from various SDK response shapes
+    response_text = _extract_text(resp)
+    if response_text is None:
+        # Resposta do Gemini sem texto (p.ex. tokens esgotados): não é uma resposta válida
+        finish_reason = _finish_reason(resp)
+        if finish_reason is not None:
+            raise _empty_response_error(m, finish_reason)
+        response_text = str(resp)
+    return _record_response(m, response_text, prompt_len, max_output_tokens, _finish_reason(resp))
+
+
+def _record_response(m, response_text, prompt_len, max_output_tokens, finish_reason=None):
+    """Registra atributos de span, logs e aviso de truncamento para a resposta final."""
+    response_len = len(response_text)
+    # Set span attributes and logs
+    try:
+        if OTEL_AVAILABLE:
+            span = _current_span()
+            span.set_attribute("model_used", m)
+            span.set_attribute("response_length", response_len)
+            span.set_attribute("prompt_length", prompt_len)
+    except Exception:
+        pass
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Usando modelo: %s; response_length=%d", m, response_len)
+
+    # Warn on truncation: finish_reason MAX_TOKENS when the SDK reports it (thinking tokens
+    # also consume the budget), otherwise the response length heuristic
+    if finish_reason == "MAX_TOKENS":
+        logger.warning("Resposta truncada: modelo %s atingiu max_output_tokens=%d (finish_reason=MAX_TOKENS)", m, max_output_tokens)
+        try:
+            if OTEL_AVAILABLE:
+                _current_span().set_attribute("possible_truncation", True)
+        except Exception:
+            pass
+    elif finish_reason is None and response_len >= int(max_output_tokens * 0.9):
+        logger.warning("Resposta com %d chars aproxima max_output_tokens=%d (possível truncamento)", response_len, max_output_tokens)
+        try:
+            if OTEL_AVAILABLE:
+                _current_span().set_attribute("possible_truncation", True)
+        except Exception:
+            pass
+
+    return response_text
+
+
+# Erros que justificam tentar o próximo modelo do fallback: modelo inexistente (404)
+# ou quota esgotada (429), seja pelo código HTTP ou pela mensagem.
+_RETRY_RE = re.compile(r"NOT_FOUND|not found|RESOURCE_EXHAUSTED|quota", re.I)
+_RETRY_CODES = frozenset({404, 429})
+
+
+def _is_api_error(exc):
+    """Erros vindos da API: google.genai.errors.APIError ou exceções com `code` (api_core)."""
+    if hasattr(exc, "code"):
+        return True
+    return NEW_GENAI and isinstance(exc, _lazy_import("google.genai.errors").APIError)
+
+
+def _is_retryable(exc):
+    # A mensagem só é considerada para erros da API; erros locais (arquivo de credenciais,
+    # TypeError etc.) com "not found"/"quota" no texto não devem disparar o fallback
+    if not _is_api_error(exc):
+        return False
+    return getattr(exc, "code", None) in _RETRY_CODES or bool(_RETRY_RE.search(str(exc)))
+
+
+# Lista de modelos da conta (client.models.list é paginada e lenta), memoizada por
+# api_key durante _MODELS_TTL segundos.
+_MODELS_TTL = 300
+_MODELS_CACHE = {}  # api_key -> (timestamp, [nomes "models/..."])
+_MODELS_CACHE_LOCK = threading.Lock()
+
+
+def _cached_models(client, api_key):
+    """Retorna os nomes dos modelos disponíveis, consultando a API só se o cache expirou."""
+    with _MODELS_CACHE_LOCK:
+        entry = _MODELS_CACHE.get(api_key)
+    if entry is not None and time.monotonic() - entry[0] < _MODELS_TTL:
+        return entry[1]
+    names = [m.name for m in client.models.list(config={"page_size": 500})]
+    with _MODELS_CACHE_LOCK:
+        _MODELS_CACHE[api_key] = (time.monotonic(), names)
+    return names
+
+
+# Cache negativo: modelos que responderam 404 para uma api_key não são tentados de novo
+# por _DEAD_MODELS_TTL segundos.
+_DEAD_MODELS_TTL = 3600
+_DEAD_MODELS = {}  # (api_key, modelo) -> expira_em
+
+
+def _mark_dead_model(api_key, model, exc):
+    if getattr(exc, "code", None) == 404 or "NOT_FOUND" in str(exc):
+        _DEAD_MODELS[(api_key, model)] = time.monotonic() + _DEAD_MODELS_TTL
+        logger.info("Modelo %s indisponível (404); ignorado pelas próximas %ds", model, _DEAD_MODELS_TTL)
+
+
+def _available_models(api_key, models_to_try):
+    """Remove do fallback modelos que deram 404 recentemente ou ausentes da listagem em cache."""
+    now = time.monotonic()
+    alive = [m for m in models_to_try if _DEAD_MODELS.get((api_key, m), 0) <= now]
+    # Se todos estiverem marcados, tenta a lista completa (o erro final lista as alternativas)
+    models_to_try = alive or models_to_try
+
+    with _MODELS_CACHE_LOCK:
+        entry = _MODELS_CACHE.get(api_key)
+    if entry is None or now - entry[0] >= _MODELS_TTL:
+        return models_to_try
+    known = {n.split("/", 1)[-1] for n in entry[1]}
+    available = [m for m in models_to_try if m.split("/", 1)[-1] in known]
+    if len(available) < len(models_to_try):
+        logger.info("Ignorando modelos indisponíveis na conta: %s", ", ".join(m for m in models_to_try if m not in available))
+    # Se nada bater (p.ex. nomes em outro formato), mantém a lista original
+    return available or models_to_try
+
+
+def _all_models_failed(client, api_key, models_to_try):
+    """Monta o RuntimeError final (com sugestões de modelos) quando todo o fallback falhou."""
+    # None of the models worked; list models to provide guidance
+    try:
+        model_names = _cached_models(client, api_key)
+        suggestions = [n.split("/", 1)[-1] for n in model_names if "gemini" in n][:6]
+        exc = RuntimeError(
+            f"Tentativas falharam para modelos {', '.join(models_to_try)}. Sugestões: {', '.join(suggestions)}\nModelos completos (exemplos): {', '.join(model_names[:20])}"
+        )
+    except Exception:
+        exc = RuntimeError(
+            f"Tentativas falharam para modelos {', '.join(models_to_try)}. (Falha ao listar modelos; verifique sua chave e permissões.)"
+        )
+    return exc
+
+
+@workflow(name="perguntar")
+def perguntar(pergunta: str, max_output_tokens: int | None = None) -> str:
+    """Faz uma pergunta ao modelo Gemini.
+
+    É necessário definir uma das variáveis de ambiente:
+    - GOOGLE_API_KEY (chave de API)
+    - GOOGLE_APPLICATION_CREDENTIALS (caminho para JSON da conta de serviço)
+
+    `max_output_tokens` sobrescreve GENAI_MAX_OUTPUT_TOKENS; sem nenhum dos dois o limite
+    é estimado pelo tamanho da pergunta (entre 8192 e 32768).
+
+    Retorna a resposta completa; para recebê-la aos poucos use `perguntar_stream`.
+    """
+    return "".join(_perguntar_stream(pergunta, max_output_tokens, buffered=True))
+
+
+def _perguntar_stream(pergunta: str, max_output_tokens: int | None = None, buffered: bool = False) -> Iterator[str]:
+    # buffered=True (usado por `perguntar`): só entrega a resposta completa, então uma falha
+    # no meio do stream ainda pode cair no próximo modelo do fallback.
+    prompt_len = len(pergunta)
+    api_key, model_name, max_output_tokens = _settings(pergunta, max_output_tokens)
+
+    cache_key = _cache_key(model_name, pergunta, _INSTRUCTIONS, 0.6, max_output_tokens) if _CACHE_ENABLED else None
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        logger.info("Resposta obtida do cache (model=%s)", model_name)
+        yield cached
+        return
+
+    # Prefer the new google-genai SDK when available
+    if not NEW_GENAI:
+        # O SDK legado não faz streaming: entrega a resposta inteira de uma vez
+        yield _perguntar_legacy(pergunta, model_name, max_output_tokens, cache_key)
+        return
+
+    client = _get_client(api_key)
+    base_config, prompt_for_model, instruction_snippet = _new_sdk_request(pergunta, max_output_tokens)
+    models_to_try = _available_models(api_key, _MODELS_TO_TRY)
+
+    cached, sem_vec, sem_namespace = _semcache_check(client, pergunta, model_name, max_output_tokens)
+    if cached is not None:
+        _cache_put(cache_key, cached)
+        yield cached
+        return
+
+    last_not_found_exc = None
+    for m in models_to_try:
+        chunks = []
+        finish_reason = None
+        try:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Tentando modelo: %s (prompt_len=%d, max_output_tokens=%d)", m, prompt_len, max_output_tokens)
+            with start_span("genai.generate_content_stream", attributes={"model": m, "prompt_length": prompt_len, "max_output_tokens": max_output_tokens} if OTEL_AVAILABLE else None):
+                # Attach the instruction snippet to the span for observability
                 try:
-                    logger.info("Tentando modelo: %s (prompt_len=%d, max_output_tokens=%d)", m, len(pergunta), max_output_tokens)
-                    with start_span("genai.generate_content", attributes={"model": m, "prompt_length": len(pergunta), "max_output_tokens": max_output_tokens}):
-                        # Optionally include instructions from the environment (GENAI_INSTRUCTIONS).
-                        # If not set, send the user prompt as-is (avoids using role-based message structures
-                        # that some SDK versions don't accept).
-                        instructions = os.getenv("GENAI_INSTRUCTIONS")
-                        if instructions:
-                            instruction_snippet = instructions[:256]
-                            prompt_for_model = f"INSTRUCTIONS:\n{instructions}\n\nUSER_QUESTION:\n{pergunta}"
-                        else:
-                            instruction_snippet = None
-                            prompt_for_model = pergunta
-
-                        resp = client.models.generate_content(
-                            model=m,
-                            contents=prompt_for_model,
-                            config=base_config,
-                        )
-                        # Attach the instruction snippet to the span for observability
-                        try:
-                            if instruction_snippet and OTEL_AVAILABLE:
-                                _trace.get_current_span().set_attribute("instruction_snippet", instruction_snippet)
-                        except Exception:
-                            pass
-                        # Extract text from various SDK response shapes
-                        response_text = None
-                        if hasattr(resp, "output_text") and resp.output_text:
-                            response_text = resp.output_text
-                        elif hasattr(resp, "text") and resp.text:
-                            response_text = resp.text
-                        elif hasattr(resp, "candidates") and resp.candidates:
-                            try:
-                                response_text = resp.candidates[0].content
-                            except Exception:
-                                response_text = None
-                        else:
-                            # Fallback: try to collect text fragments from resp.output
-                            texts = []
-                            for item in getattr(resp, "output", []):
-                                content = None
-                                if isinstance(item, dict):
-                                    content = item.get("content", [])
-                                else:
-                                    content = getattr(item, "content", [])
-                                for c in content:
-                                    if isinstance(c, dict):
-                                        if c.get("type") == "output_text":
-                                            texts.append(c.get("text", ""))
-                                        elif c.get("text"):
-                                            texts.append(c.get("text"))
-                                    else:
-                                        if getattr(c, "type", None) == "output_text":
-                                            texts.append(getattr(c, "text", ""))
-                                        elif getattr(c, "text", None):
-                                            texts.append(getattr(c, "text"))
-                            if texts:
-                                response_text = "\n".join(texts)
-
-                        if response_text is None:
-                            response_text = str(resp)
-
-                        # Set span attributes and logs
-                        try:
-                            if OTEL_AVAILABLE:
-                                _trace.get_current_span().set_attribute("model_used", m)
-                                _trace.get_current_span().set_attribute("response_length", len(response_text))
-                                _trace.get_current_span().set_attribute("prompt_length", len(pergunta))
-                        except Exception:
-                            pass
-
-                        logger.info("Usando modelo: %s; response_length=%d", m, len(response_text))
-
-                        # Warn if response approaches the max tokens (possible truncation)
-                        try:
-                            if len(response_text) >= int(max_output_tokens * 0.9):
-                                logger.warning("Resposta com %d chars aproxima max_output_tokens=%d (possível truncamento)", len(response_text), max_output_tokens)
-                                try:
-                                    if OTEL_AVAILABLE:
-                                        _trace.get_current_span().set_attribute("possible_truncation", True)
-                                except Exception:
-                                    pass
-                        except Exception:
-                            pass
-
-                        return response_text
-                except Exception as e2:
-                    # If model is not found (404) or quota exhausted (429), try next model in fallback list
-                    should_continue = False
-                    try:
-                        if genai_errors and isinstance(e2, genai_errors.ClientError):
-                            code = getattr(e2, "code", None)
-                            if code == 404 or "NOT_FOUND" in str(e2):
-                                should_continue = True
-                            if code == 429 or "RESOURCE_EXHAUSTED" in str(e2) or "quota" in str(e2).lower():
-                                should_continue = True
-                    except Exception:
-                        pass
-
-                    if should_continue:
-                        last_not_found_exc = e2
-                        continue
-                    # For other errors, re-raise
-                    raise
-
-            # If we get here, none of the models worked; list models to provide guidance
-            try:
-                models = client.models.list(config={"page_size": 200})
-                model_names = [m.name for m in models]
-                suggestions = [n.split("/", 1)[-1] for n in model_names if "gemini" in n][:6]
-                raise RuntimeError(
-                    f"Tentativas falharam para modelos {', '.join(models_to_try)}. Sugestões: {', '.join(suggestions)}\nModelos completos (exemplos): {', '.join(model_names[:20])}"
-                ) from last_not_found_exc
-            except Exception:
-                raise RuntimeError(
-                    f"Tentativas falharam para modelos {', '.join(models_to_try)}. (Falha ao listar modelos; verifique sua chave e permissões.)"
-                ) from last_not_found_exc
-        finally:
-            try:
-                client.close()
-            except Exception:
-                pass
-
-    # Legacy compatibility: older google-generativeai package
-    # versões antigas tinham genai.generate_text; as novas usam Responses API
-    # Legacy compatibility: older google-generativeai package
-    # Tentativa com fallback de modelos semelhante ao cliente novo
-    env_fallback = os.getenv("GENAI_FALLBACK_MODELS")
-    if env_fallback:
-        fallback_models = [m.strip() for m in env_fallback.split(",") if m.strip()]
-    else:
-        # Legacy fallback order: prioritize higher-quality models first
-        fallback_models = ["gemini-pro-latest", "gemini-3-pro-preview", "gemini-2.5-pro", "gemini-2.5-flash", "gemini-3-flash-preview"]
+                    if instruction_snippet and OTEL_AVAILABLE:
+                        _current_span().set_attribute("instruction_snippet", instruction_snippet)
+                except Exception:
+                    pass
+                contents, config = _request_for_model(client, api_key, m, pergunta, max_output_tokens, base_config, prompt_for_model)
+                for chunk in client.models.generate_content_stream(
+                    model=m,
+                    contents=contents,
+                    config=config,
+                ):
+                    finish_reason = _finish_reason(chunk) or finish_reason
+                    text = _extract_text(chunk)
+                    if text:
+                        chunks.append(text)
+                        if not buffered:
+                            yield text
+                if not chunks:
+                    # Stream sem texto não é sucesso: não entra nos caches
+                    raise _empty_response_error(m, finish_reason)
+                response_text = _record_response(m, "".join(chunks), prompt_len, max_output_tokens, finish_reason)
+            _cache_put(cache_key, response_text)
+            if sem_vec is not None:
+                _semcache_add(sem_vec, sem_namespace, pergunta, response_text)
+            if buffered:
+                yield response_text
+            return
+        except Exception as e2:
+            # Em modo stream só dá para trocar de modelo antes de entregar o primeiro trecho
+            if (buffered or not chunks) and _is_retryable(e2):
+                _mark_dead_model(api_key, m, e2)
+                last_not_found_exc = e2
+                continue
+            # For other errors, re-raise
+            raise
+
+    raise _all_models_failed(client, api_key, models_to_try) from last_not_found_exc
+
+
+@workflow(name="perguntar_stream")
+def perguntar_stream(pergunta: str, max_output_tokens: int | None = None) -> Iterator[str]:
+    """Faz uma pergunta ao modelo e devolve a resposta em trechos, à medida que são gerados.
+
+    Usa `generate_content_stream` do SDK novo; o fallback de modelos só ocorre antes do
+    primeiro trecho. Com o SDK legado ou em acertos de cache, a resposta vem em um único trecho.
+    """
+    yield from _perguntar_stream(pergunta, max_output_tokens)
+
+
+def _legacy_generate_text(genai, m, pergunta, max_output_tokens):
+    resp = genai.generate_text(
+        model=m,
+        prompt=pergunta,
+        max_output_tokens=max_output_tokens,
+        temperature=0.6,
+    )
+    try:
+        return resp.candidates[0].content
+    except Exception:
+        return str(resp)
 
-    models_to_try = [model_name] + [m for m in fallback_models if m != model_name]
 
-    if hasattr(genai, "generate_text"):
-        for m in models_to_try:
+def _legacy_responses_create(genai, m, pergunta, max_output_tokens):
+    resp = genai.responses.create(
+        model=m,
+        input=pergunta,
+        max_output_tokens=max_output_tokens,
+        temperature=0.6,
+    )
+    return _extract_text(resp) or str(resp)
+
+
+# APIs do SDK legado, em ordem de preferência: (rótulo, nome do span, predicado, invoke).
+# Versões antigas tinham genai.generate_text; as novas usam a Responses API.
+_LEGACY_CALLERS = (
+    ("legacy", "genai.generate_text", lambda genai: hasattr(genai, "generate_text"), _legacy_generate_text),
+    ("legacy:responses", "genai.responses.create",
+     lambda genai: hasattr(genai, "responses") and hasattr(genai.responses, "create"), _legacy_responses_create),
+)
+
+
+def _perguntar_legacy(pergunta, model_name, max_output_tokens, cache_key):
+    """Caminho do SDK legado (google-generativeai): generate_text ou Responses API."""
+    prompt_len = len(pergunta)
+    genai = _lazy_genai()
+    callers = [c for c in _LEGACY_CALLERS if c[2](genai)]
+    if not callers:
+        # If we reach here, the installed package is not compatible
+        raise AttributeError(
+            "Nenhuma API compatível encontrada. Instale 'google-genai' (recomendado): pip install --upgrade google-genai"
+        )
+
+    # Tentativa com fallback de modelos semelhante ao cliente novo; se todos falharem
+    # numa API, tenta a próxima disponível
+    last_not_found_exc = None
+    for label, span_name, _, invoke in callers:
+        for m in _MODELS_TO_TRY:
             try:
-                logger.info("Tentando modelo (legacy): %s (prompt_len=%d, max_output_tokens=%d)", m, len(pergunta), max_output_tokens)
-                with start_span("genai.generate_text", attributes={"model": m, "prompt_length": len(pergunta), "max_output_tokens": max_output_tokens}):
-                    resp = genai.generate_text(
-                        model=m,
-                        prompt=pergunta,
-                        max_output_tokens=max_output_tokens,
-                        temperature=0.6,
-                    )
-                    response_text = None
-                    try:
-                        response_text = resp.candidates[0].content
-                    except Exception:
-                        response_text = str(resp)
-
-                    try:
-                        if OTEL_AVAILABLE:
-                            _trace.get_current_span().set_attribute("model_used", m)
-                            _trace.get_current_span().set_attribute("response_length", len(response_text))
-                            _trace.get_current_span().set_attribute("prompt_length", len(pergunta))
-                    except Exception:
-                        pass
-
-                    logger.info("Usando modelo (legacy): %s; response_length=%d", m, len(response_text))
-
-                    try:
-                        if len(response_text) >= int(max_output_tokens * 0.9):
-                            logger.warning("Resposta com %d chars aproxima max_output_tokens=%d (possível truncamento)", len(response_text), max_output_tokens)
-                            try:
-                                if OTEL_AVAILABLE:
-                                    _trace.get_current_span().set_attribute("possible_truncation", True)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
-
-                    return response_text
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Tentando modelo (%s): %s (prompt_len=%d, max_output_tokens=%d)", label, m, prompt_len, max_output_tokens)
+                with start_span(span_name, attributes={"model": m, "prompt_length": prompt_len, "max_output_tokens": max_output_tokens} if OTEL_AVAILABLE else None):
+                    response_text = _record_response(m, invoke(genai, m, pergunta, max_output_tokens), prompt_len, max_output_tokens)
+                _cache_put(cache_key, response_text)
+                return response_text
             except Exception as e:
-                if "NOT_FOUND" in str(e) or "not found" in str(e).lower() or "RESOURCE_EXHAUSTED" in str(e) or "quota" in str(e).lower():
+                if _is_retryable(e):
+                    last_not_found_exc = e
                     continue
+                # Outros erros: re-raise
                 raise
 
-    if hasattr(genai, "responses") and hasattr(genai.responses, "create"):
-        for m in models_to_try:
-            resp = None
+    raise RuntimeError(
+        f"Tentativas falharam para modelos {', '.join(_MODELS_TO_TRY)} (SDK legado)."
+    ) from last_not_found_exc
+
+
+# Controle de concorrência/vazão das chamadas assíncronas: no máximo
+# GENAI_MAX_CONCURRENCY requisições em voo e, se GENAI_RPM > 0, um token bucket
+# limitando as requisições por minuto. GENAI_MAX_RETRIES controla as novas
+# tentativas no mesmo modelo após 429.
+#
+# Hedge (opcional, GENAI_HEDGE_ENABLED=1, apenas perguntar_async): se o modelo em curso não
+# responder em GENAI_HEDGE_MS, o próximo do fallback é chamado em paralelo e vence o mais rápido.
+# Todas lidas em `_reload_config`.
+
+# Primitivas asyncio ficam presas ao loop em que são usadas pela primeira vez; criamos
+# um par (semáforo, lock do bucket) por event loop para suportar vários asyncio.run.
+_LOOP_PRIMITIVES = weakref.WeakKeyDictionary()
+
+
+def _loop_primitives():
+    """Retorna (semáforo de concorrência, lock do token bucket) do event loop corrente."""
+    loop = asyncio.get_running_loop()
+    primitives = _LOOP_PRIMITIVES.get(loop)
+    if primitives is None:
+        primitives = _LOOP_PRIMITIVES[loop] = (asyncio.Semaphore(_MAX_CONCURRENCY), asyncio.Lock())
+    return primitives
+
+
+async def _acquire_token():
+    """Aguarda um token do bucket (reabastecido a GENAI_RPM/60 por segundo)."""
+    if _RPM <= 0:
+        return
+    rate = _RPM / 60.0
+    capacity = max(1.0, rate)
+    async with _loop_primitives()[1]:
+        while True:
+            now = time.monotonic()
+            _BUCKET["tokens"] = min(capacity, _BUCKET["tokens"] + (now - _BUCKET["ts"]) * rate)
+            _BUCKET["ts"] = now
+            if _BUCKET["tokens"] >= 1:
+                _BUCKET["tokens"] -= 1
+                return
+            await asyncio.sleep((1 - _BUCKET["tokens"]) / rate)
+
+
+def _is_rate_limited(exc):
+    code = getattr(exc, "code", None)
+    return code == 429 or "RESOURCE_EXHAUSTED" in str(exc)
+
+
+async def _fallback_call(call, models, hedge_delay=None):
+    """Executa `call(m)` percorrendo `models` como fallback: erros 404/429 passam ao próximo.
+
+    Com `hedge_delay` (s), se a chamada em curso não responder a tempo o próximo modelo é
+    disparado em paralelo (no máximo duas em voo) e vence o primeiro sucesso. Um erro não
+    recuperável não cancela a chamada ainda em voo: é relançado só se ela também falhar.
+    Se todos falharem, relança o último erro recuperável.
+    """
+    queue = list(models)
+    running = {asyncio.create_task(call(queue.pop(0)))}
+    last_exc = None
+    fatal_exc = None  # erro não recuperável: só relançado quando nada mais estiver em voo
+    try:
+        while running:
+            can_hedge = fatal_exc is None and hedge_delay is not None and queue and len(running) < 2
+            done, running = await asyncio.wait(running, timeout=hedge_delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info("Sem resposta em %.0fms; disparando %s em paralelo", hedge_delay * 1000, queue[0])
+                running.add(asyncio.create_task(call(queue.pop(0))))
+                continue
+            for task in done:
+                exc = task.exception()
+                if exc is None:
+                    return task.result()
+                if not _is_retryable(exc):
+                    fatal_exc = fatal_exc or exc
+                    continue
+                last_exc = exc
+                if queue and fatal_exc is None:
+                    running.add(asyncio.create_task(call(queue.pop(0))))
+        raise fatal_exc or last_exc
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def perguntar_async(pergunta: str, max_output_tokens: int | None = None) -> str:
+    """Versão assíncrona de `perguntar`, usando `client.aio` do SDK novo.
+
+    Permite sobrepor várias chamadas à API no mesmo event loop; cada loop usa seu próprio
+    cliente assíncrono (ver `_get_aio_client`). Com o SDK legado, delega para `perguntar`
+    em uma thread.
+    """
+    if not NEW_GENAI:
+        return await asyncio.to_thread(perguntar, pergunta, max_output_tokens)
+
+    prompt_len = len(pergunta)
+    api_key, model_name, max_output_tokens = _settings(pergunta, max_output_tokens)
+
+    cache_key = _cache_key(model_name, pergunta, _INSTRUCTIONS, 0.6, max_output_tokens) if _CACHE_ENABLED else None
+    cached = await _cache_get_async(cache_key)
+    if cached is not None:
+        logger.info("Resposta obtida do cache (model=%s)", model_name)
+        return cached
+
+    client = _get_client(api_key)
+    base_config, prompt_for_model, instruction_snippet = _new_sdk_request(pergunta, max_output_tokens)
+    models_to_try = _available_models(api_key, _MODELS_TO_TRY)
+
+    cached, sem_vec, sem_namespace = await asyncio.to_thread(_semcache_check, client, pergunta, model_name, max_output_tokens)
+    if cached is not None:
+        await _cache_put_async(cache_key, cached)
+        return cached
+
+    async def call(m):
+        for attempt in range(_MAX_RETRIES + 1):
             try:
-                logger.info("Tentando modelo (legacy:responses): %s (prompt_len=%d, max_output_tokens=%d)", m, len(pergunta), max_output_tokens)
-                with start_span("genai.responses.create", attributes={"model": m, "prompt_length": len(pergunta), "max_output_tokens": max_output_tokens}):
-                    resp = genai.responses.create(
-                        model=m,
-                        input=pergunta,
-                        max_output_tokens=max_output_tokens,
-                        temperature=0.6,
-                    )
-
-                    response_text = None
-                    # Prefer convenience property if disponível
-                    if hasattr(resp, "output_text") and resp.output_text:
-                        response_text = resp.output_text
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Tentando modelo (async): %s (prompt_len=%d, max_output_tokens=%d)", m, prompt_len, max_output_tokens)
+                with start_span("genai.generate_content", attributes={"model": m, "prompt_length": prompt_len, "max_output_tokens": max_output_tokens} if OTEL_AVAILABLE else None):
+                    if not (_CONTEXT_CACHE_ENABLED and _INSTRUCTIONS):
+                        contents, config = prompt_for_model, base_config
+                    elif _context_cache_entry(api_key, m, _INSTRUCTIONS, time.time()) is not None:
+                        contents, config = _request_for_model(client, api_key, m, pergunta, max_output_tokens, base_config, prompt_for_model)
                     else:
-                        # Tentar extrair texto de resp.output
-                        texts = []
-                        for item in getattr(resp, "output", []):
-                            content = None
-                            if isinstance(item, dict):
-                                content = item.get("content", [])
-                            else:
-                                content = getattr(item, "content", [])
-                            for c in content:
-                                if isinstance(c, dict):
-                                    if c.get("type") == "output_text":
-                                        texts.append(c.get("text", ""))
-                                    elif c.get("text"):
-                                        texts.append(c.get("text"))
-                                else:
-                                    if getattr(c, "type", None) == "output_text":
-                                        texts.append(getattr(c, "text", ""))
-                                    elif getattr(c, "text", None):
-                                        texts.append(getattr(c, "text"))
-                        if texts:
-                            response_text = "\n".join(texts)
-
-                    if response_text is None:
-                        response_text = str(resp)
-
-                    try:
-                        if OTEL_AVAILABLE:
-                            _trace.get_current_span().set_attribute("model_used", m)
-                            _trace.get_current_span().set_attribute("response_length", len(response_text))
-                            _trace.get_current_span().set_attribute("prompt_length", len(pergunta))
-                    except Exception:
-                        pass
-
-                    logger.info("Usando modelo (legacy:responses): %s; response_length=%d", m, len(response_text))
-
-                    try:
-                        if len(response_text) >= int(max_output_tokens * 0.9):
-                            logger.warning("Resposta com %d chars aproxima max_output_tokens=%d (possível truncamento)", len(response_text), max_output_tokens)
-                            try:
-                                if OTEL_AVAILABLE:
-                                    _trace.get_current_span().set_attribute("possible_truncation", True)
-                            except Exception:
-                                pass
-                    except Exception:
-                        pass
-
-                    return response_text
-            except Exception as e:
-                if "NOT_FOUND" in str(e) or "not found" in str(e).lower():
+                        # caches.create é síncrono: só então vale o salto para uma thread
+                        contents, config = await asyncio.to_thread(_request_for_model, client, api_key, m, pergunta, max_output_tokens, base_config, prompt_for_model)
+                    async with _loop_primitives()[0]:
+                        await _acquire_token()
+                        resp = await _get_aio_client(api_key).aio.models.generate_content(
+                            model=m,
+                            contents=contents,
+                            config=config,
+                        )
+                    return _finish_response(m, resp, prompt_len, max_output_tokens, instruction_snippet)
+            except Exception as e2:
+                # Quota (429): backoff exponencial com jitter no mesmo modelo antes de cair no fallback
+                if attempt < _MAX_RETRIES and _is_rate_limited(e2):
+                    delay = min(2 ** attempt, 30) + random.random()
+                    logger.warning("Quota excedida para %s; nova tentativa em %.1fs (%d/%d)", m, delay, attempt + 1, _MAX_RETRIES)
+                    await asyncio.sleep(delay)
                     continue
-                # Outros erros: re-raise
+                if _is_retryable(e2):
+                    _mark_dead_model(api_key, m, e2)
                 raise
 
-    # If we reach here, the installed package is not compatible
-    raise AttributeError(
-        "Nenhuma API compatível encontrada. Instale 'google-genai' (recomendado): pip install --upgrade google-genai"
-    )
+    try:
+        response_text = await _fallback_call(call, models_to_try, _HEDGE_DELAY if _HEDGE_ENABLED else None)
+    except Exception as e2:
+        if not _is_retryable(e2):
+            raise
+        raise await asyncio.to_thread(_all_models_failed, client, api_key, models_to_try) from e2
+
+    await _cache_put_async(cache_key, response_text)
+    if sem_vec is not None:
+        _semcache_add(sem_vec, sem_namespace, pergunta, response_text)
+    return response_text
+
+
+async def perguntar_batch(perguntas: list[str], max_output_tokens: int | None = None) -> list[str]:
+    """Faz várias perguntas concorrentemente; as respostas seguem a ordem de entrada."""
+    return await asyncio.gather(*(perguntar_async(p, max_output_tokens) for p in perguntas))
+
+
+_BATCH_TERMINAL_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+
+async def perguntar_bulk(perguntas: list[str], max_output_tokens: int | None = None) -> list[str]:
+    """Envia várias perguntas como um job da Batch API do Gemini (mais barato, processado no provedor).
+
+    Indicado para cargas offline: o job pode levar minutos ou horas. Perguntas já em cache
+    não são reenviadas. Com GENAI_BATCH_MODE=0 (ou SDK legado) usa `perguntar_batch`.
+    Se alguma pergunta falhar, levanta RuntimeError com `.results` (None nas falhas) e
+    `.errors` ({índice: erro}).
+    """
+    if not NEW_GENAI or not _BATCH_MODE:
+        return await perguntar_batch(perguntas, max_output_tokens)
+
+    api_key, model_name, _ = _settings()
+
+    results = [None] * len(perguntas)
+    cache_keys = [None] * len(perguntas)
+    budgets = [_output_budget(p, max_output_tokens) for p in perguntas]
+    pending = []
+    for i, pergunta in enumerate(perguntas):
+        if _CACHE_ENABLED:
+            cache_keys[i] = _cache_key(model_name, pergunta, _INSTRUCTIONS, 0.6, budgets[i])
+            results[i] = await _cache_get_async(cache_keys[i])
+        if results[i] is None:
+            pending.append(i)
+    if not pending:
+        return results
+
+    client = _get_aio_client(api_key)
+    requests = []
+    for i in pending:
+        base_config, prompt_for_model, _ = _new_sdk_request(perguntas[i], budgets[i])
+        requests.append({"contents": prompt_for_model, "config": base_config})
+
+    with start_span("genai.batches.create", attributes={"model": model_name, "batch_size": len(requests), "max_output_tokens": max(budgets)} if OTEL_AVAILABLE else None):
+        job = await client.aio.batches.create(model=model_name, src=requests)
+        logger.info("Job batch criado: %s (%d perguntas, modelo=%s)", job.name, len(requests), model_name)
+
+        # Poll com backoff até o job terminar
+        delay = 5.0
+        state = getattr(job.state, "name", str(job.state))
+        while state not in _BATCH_TERMINAL_STATES:
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 60.0)
+            job = await client.aio.batches.get(name=job.name)
+            state = getattr(job.state, "name", str(job.state))
+            logger.info("Job batch %s: %s", job.name, state)
+
+        if state != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"Job batch {job.name} terminou com estado {state}: {getattr(job, 'error', None)}")
+
+        responses = job.dest.inlined_responses or []
+        if len(responses) != len(pending):
+            raise RuntimeError(f"Job batch {job.name} retornou {len(responses)} respostas para {len(pending)} perguntas.")
+
+        # Falhas individuais não descartam as demais respostas: sucessos são cacheados
+        # e o erro agregado carrega os resultados parciais em `.results`.
+        errors = {}
+        for i, inlined in zip(pending, responses):
+            if inlined.error or inlined.response is None:
+                errors[i] = inlined.error or "resposta ausente"
+                continue
+            try:
+                results[i] = _finish_response(model_name, inlined.response, len(perguntas[i]), budgets[i])
+            except RuntimeError as e:
+                errors[i] = e
+                continue
+            await _cache_put_async(cache_keys[i], results[i])
+
+    if errors:
+        err = RuntimeError(
+            f"Job batch {job.name}: {len(errors)} de {len(perguntas)} perguntas falharam (índices {sorted(errors)}): "
+            + "; ".join(f"{i}: {e}" for i, e in sorted(errors.items()))
+        )
+        err.results = results
+        err.errors = errors
+        raise err
+    return results
 
 
 def listar_modelos():
     """Lista modelos disponíveis da conta (tenta SDK novo primeiro)."""
     if NEW_GENAI:
-        client = genai.Client()
-        try:
-            for m in client.models.list(config={"page_size": 500}):
-                print(m.name)
-        finally:
-            try:
-                client.close()
-            except Exception:
-                pass
+        api_key = os.getenv("GOOGLE_API_KEY")
+        for name in _cached_models(_get_client(api_key), api_key):
+            print(name)
+        return
     else:
         # SDK legado pode não expor listagem centralizada; tentamos heurística
         try:
+            genai = _lazy_genai()
             if hasattr(genai, "models") and hasattr(genai.models, "list"):
                 for m in genai.models.list():
                     print(m.name)
@@ -439,16 +1337,24 @@ def listar_modelos():
     print("Could not list models: SDK does not support listing models from this environment.")
 
 
+# CLI: python getDados.py [-l/--list-models] [pergunta ...]
+_PARSER = argparse.ArgumentParser(description="Faz perguntas ao modelo Gemini.")
+_PARSER.add_argument("--list-models", "-l", action="store_true", help="lista os modelos disponíveis e sai")
+_PARSER.add_argument("pergunta", nargs="*", help="pergunta (sem argumentos, é lida da entrada padrão)")
+
+
 if __name__ == "__main__":
-    # Suporta flags: --list-models
-    if "--list-models" in sys.argv or "-l" in sys.argv:
+    # Palavras iniciadas por "-" que não são opções conhecidas fazem parte da pergunta
+    args, extras = _PARSER.parse_known_args()
+    if args.list_models:
         listar_modelos()
         sys.exit(0)
 
     # Suporta uso interativo ou via argumentos de linha de comando:
     # Ex.: python getDados.py "Qual é a capital do Brasil?"
-    if len(sys.argv) > 1:
-        pergunta = " ".join(arg for arg in sys.argv[1:] if arg not in ("--list-models", "-l")).strip()
+    if args.pergunta or extras:
+        palavras = set(args.pergunta) | set(extras)
+        pergunta = " ".join(a for a in sys.argv[1:] if a in palavras).strip()
     else:
         try:
             pergunta = input("Digite sua pergunta para o modelo: ").strip()
@@ -460,8 +1366,10 @@ if __name__ == "__main__":
         print("Pergunta vazia. Abortando.", file=sys.stderr)
         sys.exit(1)
 
-    resposta = perguntar(pergunta)
-    print(resposta)
+    # Imprime os trechos conforme chegam (menor tempo até o primeiro texto)
+    for trecho in perguntar_stream(pergunta):
+        print(trecho, end="", flush=True)
+    print()
     # Exit to avoid executing any leftover example lines below
     sys.exit(0)
     pergunta = "Qual é a capital do Brasil?"